@@ -0,0 +1,87 @@
+import simpy
+import numpy as np
+from collections import deque
+
+POOLSIZE = 4096
+LOGCAPACITY = 4096
+
+class RngPool:
+    def __init__(self, draw, size = POOLSIZE):
+        self.draw = draw
+        self.values = draw(max(1, size)).tolist()
+        self.index = 0
+
+    def Next(self):
+        if self.index == len(self.values):
+            self.values = self.draw(2 * len(self.values)).tolist()
+            self.index = 0
+        value = self.values[self.index]
+        self.index += 1
+        return value
+
+class SingleServer:
+    def __init__(self, env):
+        self.env = env
+        self.busy = False
+        self.waiters = deque()
+
+    def request(self):
+        return ServerRequest(self)
+
+    def release(self, request):
+        if not request.triggered:
+            self.waiters.remove(request)
+        elif self.waiters:
+            self.waiters.popleft().succeed()
+        else:
+            self.busy = False
+
+class ServerRequest(simpy.Event):
+    def __init__(self, server):
+        super().__init__(server.env)
+        self.server = server
+        if server.busy:
+            server.waiters.append(self)
+        else:
+            server.busy = True
+            self.succeed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.server.release(self)
+
+class TimeSeriesLog:
+    def __init__(self, bucket, capacity = LOGCAPACITY):
+        self.bucket = bucket
+        self.times = np.empty(capacity, dtype = np.float64)
+        self.values = np.empty(capacity, dtype = np.int32)
+        self.size = 0
+        self.lastTime = -np.inf
+        self.pending = None
+
+    def Append(self, time, value):
+        if self.size == self.times.size:
+            self.times = np.resize(self.times, 2 * self.times.size)
+            self.values = np.resize(self.values, 2 * self.values.size)
+        self.times[self.size] = time
+        self.values[self.size] = value
+        self.size += 1
+
+    def Record(self, time, value, force = False):
+        # Within a bucket only the latest state is kept and flushed once the next bucket opens
+        if force or time - self.lastTime >= self.bucket:
+            if self.pending is not None:
+                self.Append(*self.pending)
+                self.pending = None
+            self.Append(time, value)
+            self.lastTime = time
+        else:
+            self.pending = (time, value)
+
+    def Collect(self):
+        if self.pending is not None:
+            self.Append(*self.pending)
+            self.pending = None
+        return self.times[:self.size], self.values[:self.size]
\ No newline at end of file
@@ -1,17 +1,22 @@
-import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
 import streamlit as st
 from datetime import datetime
 import numpy as np
 import io
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import multiprocessing
+import os
 import simpy
-import random
+from concurrent.futures import ProcessPoolExecutor
+from SimUtils import LOGCAPACITY, RngPool, SingleServer, TimeSeriesLog
 
 DEFAULTPARAMS = {
     'simTime': 8 * 3600,
     'meanInterval': 75,
-    'payTimePerItem': 3
+    'payTimePerItem': 3,
+    'seed': 42
 }
 
 COUNTERSDATA = {
@@ -20,38 +25,68 @@ COUNTERSDATA = {
     3: {'probability': 0.82, 'time': (120, 45), 'purchases': (5, 1)}
 }
 
+_VISITPROBS = np.array([counterData['probability'] for counterData in COUNTERSDATA.values()])
+_TIMELOW = np.array([max(0, baseTime - variation) for baseTime, variation in (counterData['time'] for counterData in COUNTERSDATA.values())])
+_TIMEHIGH = np.array([baseTime + variation for baseTime, variation in (counterData['time'] for counterData in COUNTERSDATA.values())])
+_PURCHASESLOW = np.array([max(1, basePurchases - variation) for basePurchases, variation in (counterData['purchases'] for counterData in COUNTERSDATA.values())])
+_PURCHASESHIGH = np.array([basePurchases + variation for basePurchases, variation in (counterData['purchases'] for counterData in COUNTERSDATA.values())])
+
 class Supermarket:
     def __init__(self, env, params):
         self.env = env
         self.params = params
-        self.counters = [simpy.Resource(env, capacity = 1) for _ in range(3)]
-        self.cashier = simpy.Resource(env, capacity = 1)
+        self.counters = [SingleServer(env) for _ in range(3)]
+        self.cashier = SingleServer(env)
+
+        self.rng = np.random.default_rng(params['seed'])
+        customersN = int(2 * params['simTime'] / params['meanInterval'])
+        self.interarrivalPool = RngPool(lambda n: self.rng.exponential(params['meanInterval'], n), customersN)
+        self.extraPurchasesPool = RngPool(lambda n: self.rng.integers(1, 3, n, endpoint = True), customersN)
+        countersN = len(self.counters)
+        self.visitsPool = RngPool(lambda n: self.rng.random((n, countersN)) < _VISITPROBS, customersN)
+        self.selectionTimesPool = RngPool(lambda n: self.rng.uniform(_TIMELOW, _TIMEHIGH, (n, countersN)), customersN)
+        self.purchasesPool = RngPool(lambda n: self.rng.integers(_PURCHASESLOW, _PURCHASESHIGH, (n, countersN), endpoint = True), customersN)
 
         self.stats = {
             'customersServed': 0,
             'maxQueueLength': 0,
             'maxBasketsInUse': 0,
             'cashierBusyTime': 0,
-            'queueLengths': [],
+            'queueTimes': None,
+            'queueLengths': None,
             'basketsInUse': 0,
-            'basketsHistory': [],
+            'basketsTimes': None,
+            'basketsHistory': None,
             'serviceTimes': [],
             'waitTimes': [],
             'purchaseCounts': [],
-            'customerData': []
+            'customerData': None
         }
 
         self.currentQueueLength = 0
         self.cashierBusyStart = None
+
+        logBucket = max(1.0, params['simTime'] / 2000.0)
+        self._queueLog = TimeSeriesLog(logBucket)
+        self._basketLog = TimeSeriesLog(logBucket)
+        self._customerData = {
+            'id': np.empty(LOGCAPACITY, dtype = np.int32),
+            'arrivalTime': np.empty(LOGCAPACITY, dtype = np.float64),
+            'totalPurchases': np.empty(LOGCAPACITY, dtype = np.int32),
+            'waitTime': np.empty(LOGCAPACITY, dtype = np.float64),
+            'serviceTime': np.empty(LOGCAPACITY, dtype = np.float64),
+            'exitTime': np.empty(LOGCAPACITY, dtype = np.float64)
+        }
+        self._customerN = 0
     
     def CustomerProcess(self, customerId):
-        arrivalTime = self.env
+        arrivalTime = self.env.now
 
         self.stats['basketsInUse'] += 1
         self.UpdateBasketStats()
 
         totalPurchases = yield from self.VisitCounters(customerId)
-        extraPurchases = random.randint(1, 3)
+        extraPurchases = self.extraPurchasesPool.Next()
         totalPurchases += extraPurchases
 
         queueStartTime = self.env.now
@@ -65,37 +100,31 @@ class Supermarket:
         self.stats['purchaseCounts'].append(totalPurchases)
         self.stats['waitTimes'].append(waitTime)
 
-        customerData = {
-            'id': customerId,
-            'arrivalTime': arrivalTime,
-            'totalPurchases': totalPurchases,
-            'waitTime': waitTime,
-            'serviceTime': totalPurchases * self.params['payTimePerItem'],
-            'exitTime': self.env.now
-        }
-        self.stats['customerData'].append(customerData)
+        customerData = self._customerData
+        if self._customerN == customerData['id'].size:
+            for key, values in customerData.items():
+                customerData[key] = np.resize(values, 2 * values.size)
+        row = self._customerN
+        customerData['id'][row] = customerId
+        customerData['arrivalTime'][row] = arrivalTime
+        customerData['totalPurchases'][row] = totalPurchases
+        customerData['waitTime'][row] = waitTime
+        customerData['serviceTime'][row] = totalPurchases * self.params['payTimePerItem']
+        customerData['exitTime'][row] = self.env.now
+        self._customerN += 1
 
     def VisitCounters(self, customerId):
         totalPurchases = 0
+        visits = self.visitsPool.Next()
+        selectionTimes = self.selectionTimesPool.Next()
+        purchaseCounts = self.purchasesPool.Next()
 
-        for counterId, counterData in COUNTERSDATA.items():
-            if random.random() < counterData['probability']:
-                with self.counters[counterId - 1].request() as req:
+        for counterIndex, counter in enumerate(self.counters):
+            if visits[counterIndex]:
+                with counter.request() as req:
                     yield req
-
-                    baseTime, variation = counterData['time']
-                    selectionTime = random.uniform(
-                        max(0, baseTime - variation),
-                        baseTime + variation
-                    )
-                    yield self.env.timeout(selectionTime)
-
-                    basePurchases, purchaseVariation = counterData['purchases']
-                    purchases = random.randint(
-                        max(1, basePurchases - purchaseVariation),
-                        basePurchases + purchaseVariation
-                    )
-                    totalPurchases += purchases
+                    yield self.env.timeout(selectionTimes[counterIndex])
+                    totalPurchases += purchaseCounts[counterIndex]
         
         return totalPurchases
     
@@ -122,17 +151,25 @@ class Supermarket:
                 self.cashierBusyStart = None
     
     def UpdateQueueStats(self):
-        self.stats['maxQueueLength'] = max(self.stats['maxQueueLength'], self.currentQueueLength)
-        self.stats['queueLengths'].append((self.env.now, self.currentQueueLength))
+        isPeak = self.currentQueueLength > self.stats['maxQueueLength']
+        if isPeak: self.stats['maxQueueLength'] = self.currentQueueLength
+        self._queueLog.Record(self.env.now, self.currentQueueLength, isPeak)
 
     def UpdateBasketStats(self):
-        self.stats['maxBasketsInUse'] = max(self.stats['maxBasketsInUse'], self.stats['basketsInUse'])
-        self.stats['basketsHistory'].append((self.env.now, self.stats['basketsInUse']))
+        isPeak = self.stats['basketsInUse'] > self.stats['maxBasketsInUse']
+        if isPeak: self.stats['maxBasketsInUse'] = self.stats['basketsInUse']
+        self._basketLog.Record(self.env.now, self.stats['basketsInUse'], isPeak)
+
+    def CollectStats(self):
+        self.stats['queueTimes'], self.stats['queueLengths'] = self._queueLog.Collect()
+        self.stats['basketsTimes'], self.stats['basketsHistory'] = self._basketLog.Collect()
+        self.stats['customerData'] = {key: values[:self._customerN] for key, values in self._customerData.items()}
+        return self.stats
 
 def CustomerGenerator(env, supermarket):
     customerId = 1
     while True:
-        interval = random.expovariate(1.0 / supermarket.params['meanInterval'])
+        interval = supermarket.interarrivalPool.Next()
         yield env.timeout(interval)
         env.process(supermarket.CustomerProcess(customerId))
         customerId += 1
@@ -147,22 +184,57 @@ def RunSim(params):
     if supermarket.cashierBusyStart is not None:
         supermarket.stats['cashierBusyTime'] += (params['simTime'] - supermarket.cashierBusyStart)
 
-    return supermarket.stats
+    return supermarket.CollectStats()
+
+@st.cache_data(show_spinner = False, max_entries = 16)
+def RunReplications(params, replicationsN):
+    seeds = np.random.SeedSequence(params['seed']).spawn(replicationsN)
+    replicationParams = [{**params, 'seed': seed} for seed in seeds]
+    if replicationsN == 1:
+        return [RunSim(replicationParams[0])]
+
+    # Workers must unpickle RunSim from an importable module, not from streamlit's __main__
+    import TaskA
+
+    workersN = min(os.cpu_count() or 1, replicationsN)
+    chunkSize = max(1, replicationsN // (4 * workersN))
+    with ProcessPoolExecutor(max_workers = workersN, mp_context = multiprocessing.get_context('spawn')) as executor:
+        return list(executor.map(TaskA.RunSim, replicationParams, chunksize = chunkSize))
+
+def AggregateReplications(runs):
+    results = {key: float(np.mean([run[key] for run in runs])) for key in ('customersServed', 'cashierBusyTime')}
+    results.update({key: max(run[key] for run in runs) for key in ('maxQueueLength', 'maxBasketsInUse')})
+
+    for key in ('serviceTimes', 'waitTimes', 'purchaseCounts'):
+        results[key] = [value for run in runs for value in run[key]]
+
+    results['customerData'] = {key: np.concatenate([run['customerData'][key] for run in runs]) for key in runs[0]['customerData']}
+    results['customerReps'] = np.concatenate([np.full(len(run['customerData']['id']), rep + 1, dtype = np.int32) for rep, run in enumerate(runs)])
 
-def CreateHistogram(data, title, xLabel, yLabel, color = '#1f77b4'):
+    for timesKey, valuesKey, repsKey in (('queueTimes', 'queueLengths', 'queueReps'), ('basketsTimes', 'basketsHistory', 'basketsReps')):
+        results[timesKey] = np.concatenate([run[timesKey] for run in runs])
+        results[valuesKey] = np.concatenate([run[valuesKey] for run in runs])
+        results[repsKey] = np.concatenate([np.full(len(run[valuesKey]), rep, dtype = np.int32) for rep, run in enumerate(runs)])
+
+    return results
+
+def AlignedBins(data, width = 1):
+    return np.arange(min(data) - width / 2, max(data) + width, width)
+
+def CreateHistogram(data, title, xLabel, yLabel, color = '#1f77b4', bins = 20):
     if not data:
         return None
     
-    fig = px.histogram(
-        x = data,
-        nbins = 20,
-        title = title,
-        labels = {'x': xLabel, 'y': yLabel},
-        opacity = 0.7,
-        color_discrete_sequence = [color]
-    )
+    counts, edges = np.histogram(np.asarray(data), bins = bins)
+    fig = go.Figure(go.Bar(
+        x = 0.5 * (edges[:-1] + edges[1:]),
+        y = counts,
+        marker_color = color,
+        opacity = 0.7
+    ))
 
     fig.update_layout(
+        title = title,
         bargap = 0.1,
         showlegend = False,
         xaxis_title = xLabel,
@@ -174,18 +246,20 @@ def CreateHistogram(data, title, xLabel, yLabel, color = '#1f77b4'):
 
     return fig
 
-def CreateTimeSeriesChart(timeData, valueData, title, yLabel):
-    if not timeData:
+def CreateTimeSeriesChart(timeData, valueData, title, yLabel, repData = None):
+    if len(timeData) == 0:
         return None
     
     fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x = timeData,
-        y = valueData,
-        mode = 'lines',
-        name = yLabel,
-        line = dict(width = 2)
-    ))
+    for rep in ([None] if repData is None else np.unique(repData)):
+        mask = slice(None) if rep is None else repData == rep
+        fig.add_trace(go.Scatter(
+            x = timeData[mask],
+            y = valueData[mask],
+            mode = 'lines',
+            name = yLabel if rep is None else f"{yLabel} (реплікація {rep + 1})",
+            line = dict(width = 2)
+        ))
 
     fig.update_layout(
         title = title,
@@ -196,6 +270,21 @@ def CreateTimeSeriesChart(timeData, valueData, title, yLabel):
 
     return fig
 
+def DescribeColumns(columns):
+    description = {}
+    for name, values in columns.items():
+        q25, q50, q75 = np.percentile(values, [25, 50, 75])
+        description[name] = [
+            values.size,
+            values.mean(),
+            values.std(ddof = 1) if values.size > 1 else np.nan,
+            values.min(),
+            q25, q50, q75,
+            values.max()
+        ]
+
+    return pd.DataFrame(description, index = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'])
+
 def main():
     st.set_page_config(page_title = "Моделювання магазину", layout = 'wide')
     st.title("🛒 Моделювання роботи продовольчого магазину")
@@ -206,11 +295,14 @@ def main():
         simulationHours = st.slider("Час моделювання (годин)", 1, 24, 8)
         meanInterarrival = st.slider("Середній інтервал прибуття (сек)", 30, 120, 75)
         cashierSpeed = st.slider("Час на одну покупку (сек)", 1, 10, 3)
+        replicationsN = st.slider("Кількість реплікацій", 1, 64, 8)
+        seed = st.number_input("Зерно генератора випадкових чисел", 0, 999999, DEFAULTPARAMS['seed'])
 
         params = {
             'simTime': simulationHours * 3600,
             'meanInterval': meanInterarrival,
-            'payTimePerItem': cashierSpeed
+            'payTimePerItem': cashierSpeed,
+            'seed': seed
         }
 
         st.header("📊 Параметри прилавків")
@@ -220,27 +312,21 @@ def main():
             st.write(f"Час вибору: {counterData['time'][0]}±{counterData['time'][1]} сек")
             st.write(f"Покупки: {counterData['purchases'][0]}±{counterData['purchases'][1]} шт")
         if st.button("🚀 Запустити моделювання", type = 'primary', use_container_width = True):
-            RunAndDisplaySim(params)
+            RunAndDisplaySim(params, replicationsN)
         else: st.info("👈 Оберіть параметри моделювання та натисніть кнопку 'Запустити моделювання'")
 
-def RunAndDisplaySim(params):
-    progressBar = st.progress(0)
-    statusText = st.empty()
-
-    for i in range(100):
-        progressBar.progress(i + 1)
-        statusText.text(f"⏳ Виконується моделювання... {i + 1}%")
-
+def RunAndDisplaySim(params, replicationsN):
     with st.spinner("🔄 Виконується моделювання..."):
-        results = RunSim(params)
+        results = AggregateReplications(RunReplications(params, replicationsN))
+    df = pd.DataFrame({**results['customerData'], 'rep': results['customerReps']}) if len(results['customerData']['id']) else None
 
     st.success("✅ Моделювання завершено!")
     st.header("📈 Основні результати")
 
     col1, col2, col3, col4 = st.columns(4)
-    with col1: st.metric("Обслужено покупці", results['customersServed'])
-    with col2: st.metric("Макс. черга біля каси", results["maxQueueLength"])
-    with col3: st.metric("Макс. корзинок одночасно", results['maxBasketsInUse'])
+    with col1: st.metric("Обслужено покупців (середнє за реплікацію)", f"{results['customersServed']:g}")
+    with col2: st.metric("Макс. черга біля каси", f"{results['maxQueueLength']:g}")
+    with col3: st.metric("Макс. корзинок одночасно", f"{results['maxBasketsInUse']:g}")
     with col4: 
         cashierUtilization = (results['cashierBusyTime'] / params["simTime"]) * 100
         st.metric("Завантаження касира", f"{cashierUtilization:.1f}%")
@@ -265,7 +351,8 @@ def RunAndDisplaySim(params):
                 "Розподіл кількості покупок на покупця",
                 "Кількість покупок",
                 "Кількість покупців",
-                '#4ECDC4'
+                '#4ECDC4',
+                bins = AlignedBins(results['purchaseCounts'])
             )
             if figPurchases: st.plotly_chart(figPurchases, use_container_width = True)
 
@@ -278,58 +365,61 @@ def RunAndDisplaySim(params):
                 "Розподіл часу обслуговування на касі",
                 "Час обслуговування (секунди)",
                 "Кількість покупців",
-                '#45B7D1'
+                '#45B7D1',
+                bins = AlignedBins(results['serviceTimes'], params['payTimePerItem'])
             )
             if figService: st.plotly_chart(figService, use_container_width = True)
 
     st.header("⏰ Динаміка системи в часі")
 
-    if results['queueLengths'] and len(results['queueLengths']) > 10:
+    if len(results['queueLengths']) > 10:
         sampleSize = min(1000, len(results['queueLengths']))
         step = len(results['queueLengths']) // sampleSize
-        times = [t for i, (t, _) in enumerate(results['queueLengths']) if i % step == 0]
-        queues = [q for i, (_, q) in enumerate(results['queueLengths']) if i % step == 0]
+        times = results['queueTimes'][::step]
+        queues = results['queueLengths'][::step]
+        reps = results['queueReps'][::step]
 
         figQueue = CreateTimeSeriesChart(
             times, queues,
             "Динаміка довжини черги біля каси",
-            "Довжина черги"
+            "Довжина черги",
+            reps
         )
         if figQueue: st.plotly_chart(figQueue, use_container_width = True)
 
-    if results['basketsHistory'] and len(results['basketsHistory']) > 10:
+    if len(results['basketsHistory']) > 10:
         sampleSize = min(1000, len(results['basketsHistory']))
         step = len(results['basketsHistory']) // sampleSize
 
-        times = [t for i, (t, _) in enumerate(results["basketsHistory"]) if i % step == 0]
-        baskets = [b for i, (_, b) in enumerate(results['basketsHistory']) if i % step == 0]
+        times = results['basketsTimes'][::step]
+        baskets = results['basketsHistory'][::step]
+        reps = results['basketsReps'][::step]
 
         figBaskets = CreateTimeSeriesChart(
             times, baskets,
             "Динаміка використання корзинок",
-            "Кількість корзинок"
+            "Кількість корзинок",
+            reps
         )
         if figBaskets: st.plotly_chart(figBaskets, use_container_width = True)
 
     st.header("🔍 Детальна статистика")
-    if results['customerData']:
-        df = pd.DataFrame(results['customerData'])
-
+    if df is not None:
         col1, col2 = st.columns(2)
 
         with col1:
             st.subheader("Статистика покупців")
-            st.dataframe(df.describe(), use_container_width = True)
+            st.dataframe(DescribeColumns(results['customerData']), use_container_width = True)
 
         with col2:
             st.subheader("Загальні показники")
 
             metricsData = {
                 'Показник': [
-                    'Загальна кількість покупців',
+                    'Середня кількість покупців за реплікацію',
                     'Середній час очікування (сек)',
                     'Середня кількість покупок (шт)',
-                    'Загальний час роботи касира (сек)',
+                    'Середній час роботи касира за реплікацію (сек)',
                     'Максимальна черга'
                 ],
                 'Значення': [
@@ -341,17 +431,16 @@ def RunAndDisplaySim(params):
                 ]
             }
 
-            metricDf = pd.DataFrame(metricsData)
-            st.dataframe(metricDf, use_container_width = True, hide_index = True)
+            st.table({'Значення': dict(zip(metricsData['Показник'], metricsData['Значення']))})
 
     st.header("💾 Експорт результатів")
 
-    if results['customerData']:
-        df = pd.DataFrame(results['customerData'])
-        csv = df.to_csv(index = False)
+    if df is not None:
+        csvBuffer = io.BytesIO()
+        pacsv.write_csv(pa.Table.from_pandas(df, preserve_index = False), csvBuffer)
         st.download_button(
             label = "📥 Завантажити дані у CSV",
-            data = csv,
+            data = csvBuffer.getvalue(),
             file_name = f"supermarket_simulation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
             mime = "text/csv",
             use_container_width = True
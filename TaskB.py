@@ -1,37 +1,43 @@
+import multiprocessing
+import os
 import simpy
 import numpy as np
-import random
 import streamlit as st
-import plotly.express as px
 import plotly.graph_objects as go
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from SimUtils import RngPool, SingleServer, TimeSeriesLog
 
 
 class Library:
     def __init__(self, env, params):
         self.env = env
         self.params = params
-        self.librarians = [simpy.Resource(env, capacity = 1) for _ in range(2)]
+        self.librarians = [SingleServer(env) for _ in range(2)]
         
         self.statistic = {
             'ReaderServed': 0,
             'TimeWaiting': [],
             'TimeServed': [],
             'MaxQueueLen': 0,
-            'QueueLen': [],
-            'LibrarianBusy': [0.0, 0.0],
+            'QueueTimes': None,
+            'QueueLen': None,
+            'LibrarianBusy': np.zeros(len(self.librarians)),
             'BooksPerReader': []
         }
         self.currentQueueLen = 0
+        self.queueLog = TimeSeriesLog(max(1.0, params['SimTime'] / 2000.0))
 
-    def ReaderProcess(self, readerId):
-        baseTime, variation = self.params['ServeTime'] 
+        self.rng = np.random.default_rng(params['Seed'])
+        if params['ArrivalLaw'] == "Пуассона": self.readersN = int(2 * params['SimTime'] / 3600 * params['ArrivalTime'][0])
+        else: self.readersN = int(2 * params['SimTime'] / max(1, params['ArrivalTime'][0]))
+        baseTime, variation = params['ServeTime']
+        self.serveTimePool = RngPool(lambda n: self.rng.uniform(max(1, baseTime - variation), (baseTime + variation), n), self.readersN)
+        self.booksPool = RngPool(lambda n: self.rng.integers(1, 5, n, endpoint = True), self.readersN)
 
-        librarFirstLoad = self.librarians[0].count + len(self.librarians[0].queue)
-        librarSecLoad = self.librarians[1].count + len(self.librarians[1].queue)
-        if librarFirstLoad < librarSecLoad: librarIndex = 0
-        elif librarSecLoad < librarFirstLoad: librarIndex = 1
-        else: librarIndex = 0 if self.statistic['LibrarianBusy'][0] < self.statistic['LibrarianBusy'][1] else 1
+    def ReaderProcess(self, readerId):
+        librarLoads = np.fromiter((librarian.busy + len(librarian.waiters) for librarian in self.librarians), dtype = np.int32, count = len(self.librarians))
+        candidates = np.flatnonzero(librarLoads == librarLoads.min())
+        librarIndex = int(candidates[self.statistic['LibrarianBusy'][candidates].argmin()])
         
         with self.librarians[librarIndex].request() as req:
             queueStart = self.env.now
@@ -42,9 +48,9 @@ class Library:
             self.currentQueueLen -= 1
             self.UpdateQueueStats()
             startServe = self.env.now
-            interval = random.uniform(max(1, baseTime - variation), (baseTime + variation))
+            interval = self.serveTimePool.Next()
             yield self.env.timeout(interval)
-            getBooks = random.randint(1, 5)
+            getBooks = self.booksPool.Next()
             self.statistic['TimeWaiting'].append(queueWait)
             self.statistic['TimeServed'].append(self.env.now - startServe)
             self.statistic['ReaderServed'] += 1
@@ -52,53 +58,48 @@ class Library:
             self.statistic['BooksPerReader'].append(getBooks)
 
     def UpdateQueueStats(self):
-        self.statistic['MaxQueueLen'] = max(self.statistic['MaxQueueLen'], self.currentQueueLen)
-        self.statistic['QueueLen'].append((self.env.now, self.currentQueueLen))
+        isPeak = self.currentQueueLen > self.statistic['MaxQueueLen']
+        if isPeak: self.statistic['MaxQueueLen'] = self.currentQueueLen
+        self.queueLog.Record(self.env.now, self.currentQueueLen, isPeak)
     
 def ReaderGenerator(env, library):
     readerId = 1
-    if library.params['ArrivalLaw'] == "Безперервний рівномірний":
-        baseTime, variation = library.params['ArrivalTime'] 
-        while True:
-            interval = random.uniform(max(1, baseTime - variation), (baseTime + variation))
-            yield env.timeout(interval)
-            env.process(library.ReaderProcess(readerId))
-            readerId += 1
-    elif library.params['ArrivalLaw'] == "Експоненційний":
-        while True:
-            interval = random.expovariate(1.0 / library.params['ArrivalTime'][0])
-            yield env.timeout(interval)
-            env.process(library.ReaderProcess(readerId))
-            readerId += 1
-    elif library.params['ArrivalLaw'] == "Нормальний":
-        while True:
-            baseTime, variation = library.params['ArrivalTime'] 
-            interval = max(0.1, random.gauss(baseTime, variation))
-            yield env.timeout(interval)
-            env.process(library.ReaderProcess(readerId))
-            readerId += 1
-    elif library.params['ArrivalLaw'] == "Пуассона":
-        while True:
+    rng = library.rng
+    baseTime, variation = library.params['ArrivalTime'] 
+    if library.params['ArrivalLaw'] == "Пуассона":
+        hourlyReaders = rng.poisson(baseTime, int(library.params['SimTime'] // 3600) + 1).tolist()
+        for readerN in hourlyReaders:
             yield env.timeout(3600)
-            readerN = np.random.poisson(library.params['ArrivalTime'][0])
             for _ in range(readerN):
                 env.process(library.ReaderProcess(readerId))
                 readerId += 1
+    else:
+        if library.params['ArrivalLaw'] == "Безперервний рівномірний":
+            draw = lambda n: rng.uniform(max(1, baseTime - variation), (baseTime + variation), n)
+        elif library.params['ArrivalLaw'] == "Експоненційний":
+            draw = lambda n: rng.exponential(baseTime, n)
+        elif library.params['ArrivalLaw'] == "Нормальний":
+            draw = lambda n: np.maximum(0.1, rng.normal(baseTime, variation, n))
+        sampleInterval = RngPool(draw, library.readersN).Next
+        while True:
+            yield env.timeout(sampleInterval())
+            env.process(library.ReaderProcess(readerId))
+            readerId += 1
 
-def CreateHistogram(data, title, xLabel, yLabel, color = '#1f77b4'):
+def CreateHistogram(data, title, xLabel, yLabel, color = '#1f77b4', bins = 20):
     if not data:
         return None
     
-    fig = px.histogram(
-        x = data,
-        nbins = 20,
-        title = title,
-        labels = {'x': xLabel, 'y': yLabel},
-        opacity = 0.7,
-        color_discrete_sequence = [color]
-    )
+    counts, edges = np.histogram(np.asarray(data), bins = bins)
+    fig = go.Figure(go.Bar(
+        x = 0.5 * (edges[:-1] + edges[1:]),
+        y = counts,
+        marker_color = color,
+        opacity = 0.7
+    ))
 
     fig.update_layout(
+        title = title,
         bargap = 0.1,
         showlegend = False,
         xaxis_title = xLabel,
@@ -110,18 +111,20 @@ def CreateHistogram(data, title, xLabel, yLabel, color = '#1f77b4'):
 
     return fig
 
-def CreateTimeSeriesChart(timeData, valueData, title, yLabel):
-    if not timeData:
+def CreateTimeSeriesChart(timeData, valueData, title, yLabel, repData = None):
+    if len(timeData) == 0:
         return None
     
     fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x = timeData,
-        y = valueData,
-        mode = 'lines',
-        name = yLabel,
-        line = dict(width = 2, shape='hv')
-    ))
+    for rep in ([None] if repData is None else np.unique(repData)):
+        mask = slice(None) if rep is None else repData == rep
+        fig.add_trace(go.Scatter(
+            x = timeData[mask],
+            y = valueData[mask],
+            mode = 'lines',
+            name = yLabel if rep is None else f"{yLabel} (реплікація {rep + 1})",
+            line = dict(width = 2, shape='hv')
+        ))
 
     fig.update_layout(
         title = title,
@@ -139,8 +142,39 @@ def RunSim(params):
     env.process(ReaderGenerator(env, library))
     env.run(until = params['SimTime'])
 
+    library.statistic['QueueTimes'], library.statistic['QueueLen'] = library.queueLog.Collect()
     return library.statistic
 
+@st.cache_data(show_spinner = False, max_entries = 16)
+def RunReplications(params, replicationsN):
+    seeds = np.random.SeedSequence(params['Seed']).spawn(replicationsN)
+    replicationParams = [{**params, 'Seed': seed} for seed in seeds]
+    if replicationsN == 1:
+        return [RunSim(replicationParams[0])]
+
+    # Workers must unpickle RunSim from an importable module, not from streamlit's __main__
+    import TaskB
+
+    workersN = min(os.cpu_count() or 1, replicationsN)
+    chunkSize = max(1, replicationsN // (4 * workersN))
+    with ProcessPoolExecutor(max_workers = workersN, mp_context = multiprocessing.get_context('spawn')) as executor:
+        return list(executor.map(TaskB.RunSim, replicationParams, chunksize = chunkSize))
+
+def AggregateReplications(runs):
+    results = {'ReaderServed': float(np.mean([run['ReaderServed'] for run in runs]))}
+    results['MaxQueueLen'] = max(run['MaxQueueLen'] for run in runs)
+    results['BooksIssued'] = float(np.mean([np.sum(run['BooksPerReader']) for run in runs]))
+    results['LibrarianBusy'] = np.mean([run['LibrarianBusy'] for run in runs], axis = 0).tolist()
+
+    for key in ('TimeWaiting', 'TimeServed', 'BooksPerReader'):
+        results[key] = [value for run in runs for value in run[key]]
+
+    results['QueueTimes'] = np.concatenate([run['QueueTimes'] for run in runs])
+    results['QueueLen'] = np.concatenate([run['QueueLen'] for run in runs])
+    results['QueueRep'] = np.concatenate([np.full(len(run['QueueLen']), rep, dtype = np.int32) for rep, run in enumerate(runs)])
+
+    return results
+
 def Main():
     st.set_page_config(page_title = "Моделювання бібліотеки", layout = 'wide', page_icon = "🏛️")
     st.title("📚 Моделювання роботи бібліотеки", text_alignment = 'center')
@@ -164,11 +198,15 @@ def Main():
     col1, col2 = st.columns(2)
     with col1: serveTime = st.slider("Час обслуговування на видачі книг (хвилин)", 1, 60, 3)
     with col2: serveTimePlusMinus = st.slider("± (хвилин)", 1, 60, 2, key = "serve")
+    col1, col2 = st.columns(2)
+    with col1: replicationsN = st.slider("Кількість реплікацій", 1, 64, 8)
+    with col2: seed = st.number_input("Зерно генератора випадкових чисел", 0, 999999, 42)
 
     params = {
         'SimTime': simulationHours * 3600,
         'ServeTime': (serveTime * 60, serveTimePlusMinus * 60),
-        'ArrivalLaw': selected
+        'ArrivalLaw': selected,
+        'Seed': seed
     }
     if selected == "Безперервний рівномірний": params['ArrivalTime'] = (arrivalTime * 60, arrivalTimePlusMinus * 60)
     elif selected == "Експоненційний": params['ArrivalTime'] = (arrivalTime * 60, 0)
@@ -176,19 +214,12 @@ def Main():
     elif selected == "Пуассона": params['ArrivalTime'] = (arrivalTime, 0)
 
     if st.button("🚀 Запустити моделювання", type = 'primary', use_container_width = True):
-        RunAndDisplaySim(params)
+        RunAndDisplaySim(params, replicationsN)
     else: st.info("👈 Оберіть параметри моделювання та натисніть кнопку 'Запустити моделювання'")
 
-def RunAndDisplaySim(params):
-    progresBar = st.progress(0)
-    statusText = st.empty()
-
-    for i in range(100):
-        progresBar.progress(i + 1)
-        statusText.text(f"⏳ Виконується моделювання... {i + 1}%")
-
+def RunAndDisplaySim(params, replicationsN):
     with st.spinner("🔄 Виконується моделювання..."):
-        results = RunSim(params)
+        results = AggregateReplications(RunReplications(params, replicationsN))
 
     st.success("✅ Моделювання завершено!")
     st.markdown("---")
@@ -208,10 +239,10 @@ def RunAndDisplaySim(params):
 
     st.header("📈 Основні результати")
     col1, col2, col3, col4 = st.columns(4)
-    with col1: st.metric("Обслужено читачів", results['ReaderServed'])
+    with col1: st.metric("Обслужено читачів (середнє за реплікацію)", f"{results['ReaderServed']:g}")
     with col2: st.metric("Середній час очікування в черзі (сек)", f"{np.mean(results['TimeWaiting']):.2f}")
     with col3: st.metric("Середній час обслуговування (сек)", f"{np.mean(results['TimeServed']):.2f}")
-    with col4: st.metric("Максимальна кількість читачів в залі очікування", results['MaxQueueLen'])
+    with col4: st.metric("Максимальна кількість читачів в залі очікування", f"{results['MaxQueueLen']:g}")
     libFirstKoef = min(1.0, results['LibrarianBusy'][0] / params['SimTime'])
     libSecondKoef = min(1.0, results['LibrarianBusy'][1] / params['SimTime'])
     libKoef = min(1.0, sum(results['LibrarianBusy']) / (2 * params['SimTime']))
@@ -226,16 +257,18 @@ def RunAndDisplaySim(params):
     st.progress(libKoef)
 
     st.header("⏰ Динаміка системи в часі")
-    if results['QueueLen'] and len(results['QueueLen']) > 10:
+    if len(results['QueueLen']) > 10:
         sampleSize = min(1000, len(results['QueueLen']))
         step = len(results['QueueLen']) // sampleSize
-        times = [t for i, (t, _) in enumerate(results['QueueLen']) if i % step == 0]
-        queues = [q for i, (_, q) in enumerate(results['QueueLen']) if i % step == 0] 
+        times = results['QueueTimes'][::step]
+        queues = results['QueueLen'][::step]
+        reps = results['QueueRep'][::step]
         
         figQueue = CreateTimeSeriesChart(
             times, queues,
             "Динаміка довжини черги",
-            "Довжина черги"
+            "Довжина черги",
+            reps
         )
         if figQueue: st.plotly_chart(figQueue, use_container_width = True)
 
@@ -268,26 +301,26 @@ def RunAndDisplaySim(params):
             "Розподіл кількості виданих книг",
             "Кількість книг (шт)",
             "Кількість випадків",
-            "#F5AA1E"
+            "#F5AA1E",
+            bins = np.arange(0.5, 6.5)
         )
-        figBooks.update_traces(nbinsx = 5) 
         if figBooks: st.plotly_chart(figBooks, use_container_width = True)
 
     st.header("🔍 Детальна статистика")
     st.subheader("Загальні показники")
     metricData = {
         'Показник': [
-            'Загальна кількість обслужених читачів (люд)',
+            'Середня кількість обслужених читачів за реплікацію (люд)',
             'Максимальна черга (люд)',
             'Середній час очікування (сек)',
             'Середній час обслуговування (сек)',
-            'Загальна кількість виданих книжок (шт)',
+            'Середня кількість виданих книжок за реплікацію (шт)',
             'Середня кількість виданих книжок (шт)',
-            'Загальний час роботи бібліотекарів (сек)',
+            'Середній час роботи бібліотекарів за реплікацію (сек)',
             'Коефіцієнт зайнятості бібліотекарів (%)',
-            'Загальний час роботи 1 бібліотекаря (сек)',
+            'Середній час роботи 1 бібліотекаря за реплікацію (сек)',
             'Коефіцієнт зайнятості 1 бібліотекаря (%)',
-            'Загальний час роботи 2 бібліотекаря (сек)',
+            'Середній час роботи 2 бібліотекаря за реплікацію (сек)',
             'Коефіцієнт зайнятості 2 бібліотекаря (%)'
         ],
         'Значення': [
@@ -295,7 +328,7 @@ def RunAndDisplaySim(params):
             results['MaxQueueLen'],
             round(np.mean(results['TimeWaiting']), 2) if results['TimeWaiting'] else 0,
             round(np.mean(results['TimeServed']), 2) if results['TimeServed'] else 0,
-            np.sum(results['BooksPerReader']) if results['BooksPerReader'] else 0,
+            round(results['BooksIssued'], 1),
             round(np.mean(results['BooksPerReader']), 1) if results['BooksPerReader'] else 0,
             round(np.sum(results['LibrarianBusy']), 2),
             round(libKoef * 100, 2),
@@ -306,7 +339,6 @@ def RunAndDisplaySim(params):
         ]
     }
 
-    metricDf = pd.DataFrame(metricData)
-    st.dataframe(metricDf, use_container_width = True, hide_index = True)
+    st.table({'Значення': dict(zip(metricData['Показник'], metricData['Значення']))})
         
 if __name__ == '__main__': Main()